@@ -1,14 +1,20 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file, Response
+from flask import Flask, render_template, request, redirect, url_for, flash, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime, timedelta
 import cv2
 import numpy as np
 import base64
 import os
+import threading
+import zlib
 from datetime import datetime
+from functools import lru_cache
+from io import BytesIO
 import pytz
+import qrcode
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-change-this'
@@ -21,7 +27,28 @@ else:
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Let browsers cache static assets (the face-api weights alone are ~15 MB)
+# instead of revalidating on every kiosk reload. One day keeps script/css
+# updates from going stale for long after a deploy.
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 86400
+
 db = SQLAlchemy(app)
+
+# SQLite defaults serialize dashboard reads against kiosk inserts; WAL
+# lets them proceed concurrently. No-op for Postgres deployments.
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    from sqlalchemy import event
+
+    def _set_sqlite_pragmas(dbapi_conn, connection_record):
+        cur = dbapi_conn.cursor()
+        cur.execute('PRAGMA journal_mode=WAL')
+        cur.execute('PRAGMA synchronous=NORMAL')
+        cur.execute('PRAGMA cache_size=-20000')
+        cur.execute('PRAGMA temp_store=MEMORY')
+        cur.close()
+
+    with app.app_context():
+        event.listen(db.engine, 'connect', _set_sqlite_pragmas)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
@@ -36,21 +63,33 @@ class Admin(UserMixin, db.Model):
 
 class Attendance(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
-    date = db.Column(db.String(20), nullable=False)
-    time = db.Column(db.String(20), nullable=False)
-    
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False, index=True)
+    date = db.Column(db.Date, nullable=False, index=True)
+    time = db.Column(db.Time, nullable=False)
+
+    # One mark per student per day, enforced by the DB; the unique
+    # index also covers the kiosk's duplicate lookup. The (date,
+    # student_id) index makes the daily marked-set rebuild and date-
+    # filtered reports an index-only scan.
+    __table_args__ = (
+        db.UniqueConstraint('student_id', 'date', name='uq_att_student_date'),
+        db.Index('ix_att_date_student', 'date', 'student_id'),
+    )
+
     # Add relationship
     student = db.relationship('Student', backref='attendance_records')
 
 class Student(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
-    class_name = db.Column(db.String(100), nullable=False)
+    name = db.Column(db.String(100), nullable=False, index=True)
+    class_name = db.Column(db.String(100), nullable=False, index=True)
     class_display_id = db.Column(db.String(20))
     encoding = db.Column(db.LargeBinary)
     enrolled = db.Column(db.Boolean, default=False)
 
+    # Narrows the per-class MAX(CAST(class_display_id)) aggregate
+    __table_args__ = (db.Index('ix_student_class_display', 'class_name', 'class_display_id'),)
+
 class KioskStatus(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     active = db.Column(db.Boolean, default=False)
@@ -60,6 +99,222 @@ class KioskStatus(db.Model):
 def load_user(user_id):
     return Admin.query.get(int(user_id))
 
+# Face matching cache
+# Enrolled faces are 100x100 grayscale templates. Keep them all in one
+# contiguous (N, 10000) matrix so the matcher streams a packed array
+# instead of chasing N separate Python objects.
+FACE_SIZE = (100, 100)
+FACE_PIXELS = FACE_SIZE[0] * FACE_SIZE[1]
+
+def normalize_face_rows(rows):
+    # Zero-mean, unit-norm rows: matching then reduces to one dot product
+    # per stored face, so the per-query work is a single GEMV.
+    rows = rows.astype(np.float32)
+    rows -= rows.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(rows, axis=1, keepdims=True)
+    rows /= np.maximum(norms, 1e-10)
+    return rows
+
+class FaceEncodingCache:
+    # Readers get an immutable snapshot tuple; update() builds a fresh
+    # pair and rebinds it atomically, so get_data never needs to copy.
+    # Callers must treat the returned arrays as read-only.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.load_lock = threading.Lock()
+        self.loaded = False
+        self._snapshot = (np.empty((0, FACE_PIXELS), dtype=np.float32),
+                          np.empty(0, dtype=np.int64))
+        # id -> row index, so re-enrolling is a dict hit not an array scan
+        self._id_to_row = {}
+
+    def update(self, encodings, student_ids):
+        normalized = normalize_face_rows(encodings)
+        with self.lock:
+            self._snapshot = (normalized, student_ids)
+            self._id_to_row = {int(sid): i for i, sid in enumerate(student_ids)}
+
+    def get_data(self):
+        return self._snapshot
+
+    def add_or_replace(self, student_id, encoding_bytes):
+        # Wait out any in-flight full load first: if the loader's SELECT
+        # ran before this enrollment committed, the new template is not
+        # in its snapshot and must be patched in here. Once loaded is
+        # False after the wait, no load is running, so the row is safe
+        # to leave for the eventual full load; patching an unloaded
+        # cache would publish a partial gallery.
+        with self.load_lock:
+            if not self.loaded:
+                return
+        row = normalize_face_rows(np.frombuffer(encoding_bytes, dtype=np.uint8)[None, :])
+        with self.lock:
+            encodings, student_ids = self._snapshot
+            found = self._id_to_row.get(int(student_id))
+            if found is not None:
+                # Copy-on-write so readers holding the old snapshot are safe
+                encodings = encodings.copy()
+                encodings[found] = row[0]
+                self._snapshot = (encodings, student_ids)
+            else:
+                self._id_to_row[int(student_id)] = len(student_ids)
+                self._snapshot = (np.vstack([encodings, row]),
+                                  np.append(student_ids, student_id))
+
+    def remove(self, student_id):
+        # Same ordering concern as add_or_replace: a load in flight may
+        # have selected the row being deleted, so wait it out and patch
+        # the snapshot it publishes.
+        with self.load_lock:
+            if not self.loaded:
+                return
+        with self.lock:
+            encodings, student_ids = self._snapshot
+            if int(student_id) not in self._id_to_row:
+                return
+            keep = student_ids != student_id
+            self._snapshot = (encodings[keep], student_ids[keep])
+            self._id_to_row = {int(sid): i for i, sid in enumerate(student_ids[keep])}
+
+# One cache shard per class: enroll/delete only touch their own shard
+# and a kiosk scan covers just the owning admin's class.
+class_caches = {}
+_class_caches_lock = threading.Lock()
+
+def get_face_cache(class_name):
+    with _class_caches_lock:
+        cache = class_caches.get(class_name)
+        if cache is None:
+            cache = FaceEncodingCache()
+            class_caches[class_name] = cache
+        return cache
+
+class TodayMarkedCache:
+    # Fast path for the kiosk's duplicate check: most hot-kiosk matches
+    # are students already marked today, so remember today's set and
+    # answer those without a DB round trip. A cache miss goes straight
+    # to the INSERT; duplicates from other workers' inserts are absorbed
+    # by the UNIQUE(student_id, date) constraint's IntegrityError path.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.date = None
+        self.ids = set()
+
+    def contains(self, student_id, today):
+        with self.lock:
+            if self.date != today:
+                rows = db.session.query(Attendance.student_id).filter(
+                    Attendance.date == today
+                ).all()
+                self.ids = {r[0] for r in rows}
+                self.date = today
+            return student_id in self.ids
+
+    def add(self, student_id, today):
+        with self.lock:
+            if self.date == today:
+                self.ids.add(student_id)
+
+    def discard(self, student_id):
+        # Evict on student delete: SQLite reuses rowids, so a student
+        # added after a same-day delete can inherit the deleted id and
+        # would otherwise be reported "Already marked today".
+        with self.lock:
+            self.ids.discard(student_id)
+
+today_marked = TodayMarkedCache()
+
+def load_face_encodings_thread_safe(class_name):
+    # Single-flight: if another thread is already loading this shard,
+    # just wait for it to publish its snapshot instead of issuing a
+    # duplicate full query (thundering herd on boot / refresh).
+    cache = get_face_cache(class_name)
+    if not cache.load_lock.acquire(blocking=False):
+        with cache.load_lock:
+            pass
+        return
+    try:
+        # Column-only query: no ORM instance construction per student
+        total = db.session.query(db.func.count(Student.id)).filter(
+            Student.enrolled == True,
+            Student.class_name == class_name
+        ).scalar()
+        rows = db.session.query(Student.id, Student.encoding).filter(
+            Student.enrolled == True,
+            Student.class_name == class_name
+        ).yield_per(500)
+        arr = np.empty((total, FACE_PIXELS), dtype=np.uint8)
+        ids = np.empty(total, dtype=np.int64)
+        count = 0
+        for student_id, encoding in rows:
+            if not encoding or len(encoding) != FACE_PIXELS or count >= total:
+                continue
+            arr[count] = np.frombuffer(encoding, dtype=np.uint8)
+            ids[count] = student_id
+            count += 1
+        cache.update(arr[:count], ids[:count])
+        cache.loaded = True
+    finally:
+        cache.load_lock.release()
+
+# Parsing the Haar cascade XML costs tens of ms; build it once per
+# worker thread (detectMultiScale is not thread-safe on a shared
+# instance) instead of on every request.
+_detector_local = threading.local()
+
+def get_face_cascade():
+    cascade = getattr(_detector_local, 'face_cascade', None)
+    if cascade is None:
+        cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        _detector_local.face_cascade = cascade
+    return cascade
+
+# Optional DNN detector: set FACE_DETECTOR_MODEL to a YuNet .onnx path
+# to run detection in OpenCV's DNN backend (faster and more accurate on
+# webcam frontal faces). Without it, the Haar cascade is used.
+FACE_DETECTOR_MODEL = os.environ.get('FACE_DETECTOR_MODEL', '')
+
+def detect_faces(gray_frame):
+    if FACE_DETECTOR_MODEL:
+        detector = getattr(_detector_local, 'yunet', None)
+        if detector is None:
+            detector = cv2.FaceDetectorYN.create(FACE_DETECTOR_MODEL, '', (320, 240))
+            _detector_local.yunet = detector
+        h, w = gray_frame.shape[:2]
+        detector.setInputSize((w, h))
+        _, faces = detector.detect(cv2.cvtColor(gray_frame, cv2.COLOR_GRAY2BGR))
+        if faces is None:
+            return []
+        return [tuple(int(v) for v in f[:4]) for f in faces]
+    # Coarser pyramid (1.2) plus a minimum size cuts cascade levels a
+    # lot; at kiosk distance faces fill well over 60px of a <=480px frame
+    return list(get_face_cascade().detectMultiScale(
+        gray_frame, scaleFactor=1.2, minNeighbors=5, minSize=(60, 60)))
+
+def get_frame_bytes():
+    # Raw multipart uploads carry the JPEG directly; the JSON data-URI
+    # path (base64, ~33% larger and one extra decode) is kept as a
+    # fallback for older clients.
+    if 'image' in request.files:
+        return request.files['image'].read()
+    data = request.get_json()
+    image_data = data.get('image', '') if data else ''
+    header, encoded = image_data.split(',', 1)
+    return base64.b64decode(encoded)
+
+def get_kiosk_caches():
+    # An active kiosk belongs to one admin, so only that class's shard
+    # needs scanning; without an owner, fall back to every enrolled class.
+    kiosk = KioskStatus.query.first()
+    if kiosk and kiosk.active and kiosk.admin_info:
+        admin = Admin.query.filter_by(username=kiosk.admin_info).first()
+        if admin:
+            return [(admin.class_name, get_face_cache(admin.class_name))]
+    class_names = [row[0] for row in db.session.query(Student.class_name).filter(
+        Student.enrolled == True
+    ).distinct()]
+    return [(name, get_face_cache(name)) for name in class_names]
+
 # Routes
 @app.route('/')
 def home():
@@ -121,12 +376,16 @@ def welcome():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    total_students = Student.query.filter_by(class_name=current_user.class_name).count()
-    today = datetime.now().strftime('%Y-%m-%d')
-    todays_count = Attendance.query.join(Student).filter(
-        Student.class_name == current_user.class_name,
-        Attendance.date == today
-    ).count()
+    today = datetime.now().date()
+    # One round trip for both counts: left-join today's attendance onto
+    # the class roster and count rows/matches together
+    total_students, todays_count = db.session.query(
+        db.func.count(db.distinct(Student.id)),
+        db.func.count(Attendance.id)
+    ).select_from(Student).outerjoin(
+        Attendance, db.and_(Attendance.student_id == Student.id,
+                            Attendance.date == today)
+    ).filter(Student.class_name == current_user.class_name).one()
     
     kiosk = KioskStatus.query.first()
     kiosk_active = kiosk.active if kiosk else False
@@ -146,9 +405,10 @@ def students():
         name = request.form['name']
         class_name = current_user.class_name
         
-        last_student = Student.query.filter_by(class_name=class_name).order_by(Student.id.desc()).first()
-        new_id = (last_student.class_display_id if last_student else '0')
-        new_num = int(new_id) + 1 if new_id.isdigit() else 1
+        # One aggregate round trip; the DB keeps assigning the real id
+        new_num = db.session.query(
+            db.func.coalesce(db.func.max(db.cast(Student.class_display_id, db.Integer)), 0) + 1
+        ).filter(Student.class_name == class_name).scalar()
         class_display_id = str(new_num).zfill(3)
         
         new_student = Student(name=name, class_name=class_name, class_display_id=class_display_id)
@@ -158,12 +418,11 @@ def students():
         return redirect(url_for('enroll_face', id=new_student.id))
     
     students_list = Student.query.filter_by(class_name=current_user.class_name).all()
-    
-    # Create enrolled_status dictionary
-    enrolled_status = {}
-    for s in students_list:
-        enrolled_status[s.id] = s.enrolled
-    
+
+    # The enrolled flag lives on each row already - no membership scan
+    # against the face cache needed
+    enrolled_status = {s.id: s.enrolled for s in students_list}
+
     return render_template('students.html', students=students_list, enrolled_status=enrolled_status)
 
 
@@ -184,35 +443,43 @@ def capture_face(id):
         return {'status': 'error', 'message': 'Access denied!'}
     
     try:
-        data = request.get_json()
-        image_data = data.get('image', '')
-        
-        header, encoded = image_data.split(',', 1)
-        image_bytes = base64.b64decode(encoded)
+        image_bytes = get_frame_bytes()
         nparr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        if img is None:
+        # Half-resolution grayscale decode inside libjpeg: ~4x fewer
+        # pixels produced, and the 100x100 template never needs more.
+        # Must stay in step with the kiosk decode so templates and
+        # probes come from the same pipeline.
+        gray = cv2.imdecode(nparr, cv2.IMREAD_REDUCED_GRAYSCALE_2)
+
+        if gray is None:
             return {'status': 'error', 'message': 'Invalid image'}
-        
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        faces = face_cascade.detectMultiScale(gray, 1.1, 5)
-        
+
+        # Same downscaled-detect / full-res-crop split as the kiosk path,
+        # so enrolled templates stay comparable with probe crops
+        scale = 480.0 / max(gray.shape)
+        if scale < 1.0:
+            small = cv2.resize(gray, None, fx=scale, fy=scale)
+        else:
+            small = gray
+            scale = 1.0
+
+        faces = detect_faces(small)
+
         if len(faces) == 0:
             return {'status': 'error', 'message': 'No face detected. Please position your face in the camera.'}
-        
-        x, y, w, h = faces[0]
+
+        x, y, w, h = (int(v / scale) for v in faces[0])
         face_roi = gray[y:y+h, x:x+w]
-        
+
         # Resize to fixed size for consistency
-        face_roi = cv2.resize(face_roi, (100, 100))
+        face_roi = cv2.resize(face_roi, FACE_SIZE)
         
         # Store as bytes
         student.encoding = face_roi.tobytes()
         student.enrolled = True
         db.session.commit()
-        
+        get_face_cache(student.class_name).add_or_replace(student.id, student.encoding)
+
         return {'status': 'success', 'message': 'Face enrolled successfully!'}
         
     except Exception as e:
@@ -246,6 +513,11 @@ def delete_student(id):
     Attendance.query.filter_by(student_id=id).delete()
     db.session.delete(student)
     db.session.commit()
+    get_face_cache(student.class_name).remove(id)
+    today_marked.discard(id)
+    # The (max id, count) watermark can repeat after a delete once SQLite
+    # reuses the freed rowid, so drop the memo outright on this path.
+    _insights_data.cache_clear()
     flash('Student deleted!', 'success')
     return redirect(url_for('students'))
 
@@ -260,28 +532,27 @@ def attendance():
     student_ids = [s.id for s in students]
     
     # Default to today's date if no filter
-    if not date_filter:
-        date_filter = datetime.now().strftime('%Y-%m-%d')
-    
-    # Query attendance for these students
-    query = Attendance.query.filter(
+    try:
+        date_value = datetime.strptime(date_filter, '%Y-%m-%d').date()
+    except ValueError:
+        date_value = datetime.now().date()
+        date_filter = date_value.strftime('%Y-%m-%d')
+
+    # Query attendance for these students; joinedload pulls each row's
+    # student in the same query instead of one lazy SELECT per record
+    # when the template reads record.student
+    query = Attendance.query.options(db.joinedload(Attendance.student)).filter(
         Attendance.student_id.in_(student_ids),
-        Attendance.date == date_filter
+        Attendance.date == date_value
     )
-    
+
     if search:
-        query = query.filter(Attendance.student_id.in_(
-            [s.id for s in students if search.lower() in s.name.lower()]
-        ))
-    
+        # Prefix match in SQL: parameterized, and usable by the index on
+        # Student.name (the old Python substring scan loaded every name)
+        query = query.join(Student).filter(Student.name.ilike(f'{search}%'))
+
     records = query.order_by(Attendance.id.desc()).all()
-    
-    # Add student info to each record
-    for r in records:
-        student = Student.query.get(r.student_id)
-        r.student_name = student.name
-        r.student_display_id = student.class_display_id
-    
+
     return render_template('attendance.html', records=records, current_date=date_filter)
 
 
@@ -291,31 +562,48 @@ def export_attendance_csv():
     date_filter = request.args.get('date', '')
     search = request.args.get('search', '')
     
-    query = Attendance.query.join(Student).filter(Student.class_name == current_user.class_name)
-    
+    class_name = current_user.class_name
+
+    query = db.session.query(
+        Student.class_display_id, Student.name, Attendance.date, Attendance.time
+    ).select_from(Attendance).join(
+        Student, Attendance.student_id == Student.id
+    ).filter(Student.class_name == class_name)
+
     if date_filter:
-        query = query.filter(Attendance.date == date_filter)
+        try:
+            query = query.filter(Attendance.date == datetime.strptime(date_filter, '%Y-%m-%d').date())
+        except ValueError:
+            pass
     if search:
         query = query.filter(Student.name.ilike(f'%{search}%'))
-    
-    records = query.all()
-    
-    # Get class name
-    class_name = current_user.class_name
-    
-    # Create CSV with class name in heading
-    csv_data = f'Attendance Report\n'
-    csv_data += f'Class: {class_name}\n'
-    csv_data += f'Date: {date_filter if date_filter else "All Dates"}\n'
-    csv_data += f'Generated on: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}\n\n'
-    csv_data += 'Student ID,Name,Date,Time\n'
-    
-    for r in records:
-        student = Student.query.get(r.student_id)
-        csv_data += f'{student.class_display_id},{student.name},{r.date},{r.time}\n'
-    
+
+    # Stream rows as the query scrolls instead of building one big string
+    def generate():
+        yield 'Attendance Report\n'
+        yield f'Class: {class_name}\n'
+        yield f'Date: {date_filter if date_filter else "All Dates"}\n'
+        yield f'Generated on: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}\n\n'
+        yield 'Student ID,Name,Date,Time\n'
+        for display_id, name, date, time in query.yield_per(500):
+            yield f'{display_id},{name},{date},{time}\n'
+
     filename = f'attendance_{class_name}.csv'
-    return Response(csv_data, mimetype='text/csv', headers={'Content-Disposition': f'attachment;filename={filename}'})
+    headers = {'Content-Disposition': f'attachment;filename={filename}'}
+
+    # CSV compresses ~10x; gzip the stream on the fly when accepted
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        def gzipped(gen):
+            comp = zlib.compressobj(wbits=31)
+            for chunk in gen:
+                data = comp.compress(chunk.encode())
+                if data:
+                    yield data
+            yield comp.flush()
+        headers['Content-Encoding'] = 'gzip'
+        return Response(stream_with_context(gzipped(generate())), mimetype='text/csv', headers=headers)
+
+    return Response(stream_with_context(generate()), mimetype='text/csv', headers=headers)
 
 @app.route('/kiosk_status', methods=['GET', 'POST', 'DELETE'])
 @login_required
@@ -350,48 +638,60 @@ def kiosk_display():
 @app.route('/mark_attendance_student', methods=['POST'])
 def mark_attendance_student():
     try:
-        data = request.get_json()
-        image_data = data.get('image', '')
-        
-        header, encoded = image_data.split(',', 1)
-        image_bytes = base64.b64decode(encoded)
+        image_bytes = get_frame_bytes()
         nparr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        if img is None:
+        # Decode straight to grayscale - the matcher never looks at color,
+        # so this skips the BGR decode and the cvtColor pass entirely,
+        # and the half-resolution decode matches the enrollment path.
+        gray = cv2.imdecode(nparr, cv2.IMREAD_REDUCED_GRAYSCALE_2)
+
+        if gray is None:
             return {'status': 'error', 'message': 'Invalid image'}
-        
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        faces = face_cascade.detectMultiScale(gray, 1.1, 5)
-        
+
+        # Detect on a downscaled frame (max 480px on the long side) - the
+        # cascade pyramid shrinks quadratically with resolution. The face
+        # is then cropped from the full-resolution frame.
+        scale = 480.0 / max(gray.shape)
+        if scale < 1.0:
+            small = cv2.resize(gray, None, fx=scale, fy=scale)
+        else:
+            small = gray
+            scale = 1.0
+
+        faces = detect_faces(small)
+
         if len(faces) == 0:
             return {'status': 'error', 'message': 'No face detected'}
-        
-        x, y, w, h = faces[0]
+
+        x, y, w, h = (int(v / scale) for v in faces[0])
         face_roi = gray[y:y+h, x:x+w]
-        face_roi = cv2.resize(face_roi, (100, 100))
-        
-        # Get all enrolled students
-        students = Student.query.filter(Student.enrolled == True).all()
-        
-        best_match = None
-        best_score = 0
-        
-        for student in students:
-            if student.encoding:
-                known_face = np.frombuffer(student.encoding, dtype=np.uint8).reshape(100, 100)
-                
-                # Simple comparison using template matching
-                result = cv2.matchTemplate(face_roi, known_face, cv2.TM_CCOEFF_NORMED)
-                score = result[0][0]
-                
-                if score > best_score and score > 0.5:
-                    best_score = score
-                    best_match = student
-        
-        if not best_match:
+        face_roi = cv2.resize(face_roi, FACE_SIZE)
+        
+        # Cached rows are already zero-mean unit-norm, so the normalized
+        # correlation against every enrolled face is a single GEMV.
+        probe = face_roi.astype(np.float32).ravel()
+        probe -= probe.mean()
+        probe /= max(np.linalg.norm(probe), 1e-10)
+
+        # Match against the relevant class shard(s), not the whole school
+        best_id = None
+        best_score = 0.5
+        for class_name, cache in get_kiosk_caches():
+            if not cache.loaded:
+                load_face_encodings_thread_safe(class_name)
+            encodings, student_ids = cache.get_data()
+            if encodings.shape[0] == 0:
+                continue
+            scores = encodings @ probe
+            best_idx = int(np.argmax(scores))
+            if scores[best_idx] > best_score:
+                best_score = scores[best_idx]
+                best_id = int(student_ids[best_idx])
+
+        if best_id is None:
             return {'status': 'error', 'message': 'Face not recognized'}
+
+        best_match = Student.query.get(best_id)
         
         
 
@@ -400,16 +700,24 @@ def mark_attendance_student():
 
         # When marking attendance - use IST
         now = datetime.now(IST)
-        today = now.strftime('%Y-%m-%d')
-        time_now = now.strftime('%H:%M:%S')
+        today = now.date()
+        time_now = now.time().replace(microsecond=0)
                 
-        if Attendance.query.filter_by(student_id=best_match.id, date=today).first():
+        if today_marked.contains(best_match.id, today):
             return {'status': 'info', 'message': 'Already marked today'}
-        
+
+        # Insert and let the UNIQUE(student_id, date) constraint reject
+        # duplicates - one round trip, race-safe across workers
         new_attendance = Attendance(student_id=best_match.id, date=today, time=time_now)
         db.session.add(new_attendance)
-        db.session.commit()
-        
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            today_marked.add(best_match.id, today)
+            return {'status': 'info', 'message': 'Already marked today'}
+        today_marked.add(best_match.id, today)
+
         return {'status': 'success', 'message': f'Attendance marked for {best_match.name}!'}
     
     except Exception as e:
@@ -419,22 +727,25 @@ def mark_attendance_student():
 @app.route('/blacklist')
 @login_required
 def blacklist():
-    today = datetime.now()
+    today = datetime.now().date()
     week_start = today - timedelta(days=today.weekday())
     week_end = week_start + timedelta(days=6)
-    week_start_str = week_start.strftime('%Y-%m-%d')
-    week_end_str = week_end.strftime('%Y-%m-%d')
     
     students_list = Student.query.filter_by(class_name=current_user.class_name).all()
+
+    # One GROUP BY instead of a COUNT query per student
+    counts = dict(db.session.query(
+        Attendance.student_id, db.func.count(Attendance.id)
+    ).filter(
+        Attendance.student_id.in_([s.id for s in students_list]),
+        Attendance.date >= week_start,
+        Attendance.date <= week_end
+    ).group_by(Attendance.student_id).all())
+
     blacklisted_students = []
-    
+
     for student in students_list:
-        attendance_count = Attendance.query.filter(
-            Attendance.student_id == student.id,
-            Attendance.date >= week_start_str,
-            Attendance.date <= week_end_str
-        ).count()
-        
+        attendance_count = counts.get(student.id, 0)
         percentage = (attendance_count / 5) * 100 if 5 > 0 else 0
         
         if percentage < 50:
@@ -445,50 +756,59 @@ def blacklist():
                 'percentage': round(percentage, 1)
             })
     
-    return render_template('blacklist.html', 
+    return render_template('blacklist.html',
                          blacklisted_students=blacklisted_students,
-                         week_start=week_start_str,
-                         week_end=week_end_str)
-
-@app.route('/insights')
-@login_required
-def insights():
-    total_records = Attendance.query.join(Student).filter(
-        Student.class_name == current_user.class_name
-    ).count()
-    
-    unique_students = db.session.query(Attendance.student_id).join(Student).filter(
-        Student.class_name == current_user.class_name
-    ).distinct().count()
-    
+                         week_start=week_start.strftime('%Y-%m-%d'),
+                         week_end=week_end.strftime('%Y-%m-%d'))
+
+# Memoized on (class_name, max attendance id, row count), which every
+# insert changes. Deletes are not reliably visible in that key - SQLite
+# reuses rowids, so a delete followed by an insert can restore both max
+# and count - so the delete path (delete_student) calls cache_clear()
+# instead of relying on the watermark.
+@lru_cache(maxsize=32)
+def _insights_data(class_name, watermark):
+    # The per-student GROUP BY already contains both totals: summing the
+    # counts gives total records and the number of groups is the number
+    # of distinct students - one query instead of three.
     attendance_per_student = db.session.query(
         Student.name,
         db.func.count(Attendance.id)
     ).join(Attendance, Student.id == Attendance.student_id).filter(
-        Student.class_name == current_user.class_name
+        Student.class_name == class_name
     ).group_by(Student.id, Student.name).all()
-    
-    insights_data = {
-        'total_records': total_records,
-        'unique_students': unique_students,
+
+    return {
+        'total_records': sum(count for _, count in attendance_per_student),
+        'unique_students': len(attendance_per_student),
         'attendance_per_student': attendance_per_student
     }
-    
-    return render_template('insights.html', insights_data=insights_data)
 
-@app.route('/qr_code')
+@app.route('/insights')
 @login_required
-def qr_code():
-    import qrcode
-    from io import BytesIO
-    
-    url = request.host_url.rstrip('/') + '/kiosk_display'
+def insights():
+    watermark = tuple(db.session.query(
+        db.func.max(Attendance.id), db.func.count(Attendance.id)
+    ).first())
+    insights_data = _insights_data(current_user.class_name, watermark)
+
+    return render_template('insights.html', insights_data=insights_data)
+
+# The QR payload only depends on the host, so render the PNG once per
+# host and serve the cached bytes afterwards.
+@lru_cache(maxsize=4)
+def _qr_png(url):
     img = qrcode.make(url)
     buf = BytesIO()
     img.save(buf, 'PNG')
-    buf.seek(0)
-    
-    return send_file(buf, mimetype='image/png')
+    return buf.getvalue()
+
+@app.route('/qr_code')
+@login_required
+def qr_code():
+    png = _qr_png(request.host_url.rstrip('/') + '/kiosk_display')
+    return Response(png, mimetype='image/png',
+                    headers={'Cache-Control': 'public, max-age=86400'})
 
 @app.route('/test_login', methods=['GET', 'POST'])
 def test_login():
@@ -520,8 +840,34 @@ def test_login():
     '''
 
 
+def warm_up():
+    # Pay the one-time costs at boot instead of on the first kiosk scan:
+    # parse the Haar cascade and preload every class's face shard.
+    get_face_cascade()
+    class_names = [row[0] for row in db.session.query(Student.class_name).filter(
+        Student.enrolled == True
+    ).distinct()]
+    for class_name in class_names:
+        load_face_encodings_thread_safe(class_name)
+
+def init_db():
+    # The database (Postgres on Railway) can come up after the web
+    # process; retry with backoff instead of failing or sleeping a
+    # fixed amount.
+    from sqlalchemy.exc import OperationalError
+    import time
+    for attempt in range(5):
+        try:
+            db.create_all()
+            return
+        except OperationalError:
+            if attempt == 4:
+                raise
+            time.sleep(0.5 * 2 ** attempt)
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     with app.app_context():
-        db.create_all()
+        init_db()
+        warm_up()
     app.run(debug=True, host='0.0.0.0', port=port)
\ No newline at end of file